@@ -4,15 +4,54 @@ import sys
 import re
 import os
 import logging, logging.handlers
+import multiprocessing
 
-from string import punctuation, digits, maketrans
+from string import punctuation, digits
+try:
+    from string import maketrans
+except ImportError:
+    #removed from the string module in python 3
+    maketrans = str.maketrans
+
+import six
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+try:
+    from functools import lru_cache
+except ImportError:
+    #Splunk's python 2 runtime has no functools.lru_cache; the stand-in
+    #drops the whole cache at maxsize rather than growing without bound
+    #on high-cardinality tokens
+    def lru_cache(maxsize=None):
+        def decorator(func):
+            cache = {}
+            def wrapper(*args):
+                try:
+                    return cache[args]
+                except KeyError:
+                    if maxsize is not None and len(cache) >= maxsize:
+                        cache.clear()
+                    result = cache[args] = func(*args)
+                    return result
+            return wrapper
+        return decorator
 
 from splunk.appserver.mrsparkle.lib.util import make_splunkhome_path
 from splunk import setupSplunkLogger
-from nltk import word_tokenize, pos_tag
-from nltk.data import path as nltk_data_path
+from nltk import word_tokenize
+from nltk.data import path as nltk_data_path, load as nltk_data_load
+from nltk.tag.mapping import map_tag
+from nltk.tag.perceptron import PerceptronTagger
+from nltk.tokenize import TreebankWordTokenizer
 from nltk.corpus import wordnet, stopwords as stop_words
-from nltk.stem import WordNetLemmatizer, PorterStemmer
+#POS constants without touching the wordnet LazyCorpusLoader, which would
+#parse the whole corpus index at import time
+from nltk.corpus.reader.wordnet import ADJ, ADV, NOUN, VERB
+from nltk.stem import WordNetLemmatizer, SnowballStemmer, LancasterStemmer, PorterStemmer
 from nltk.util import ngrams
 from splunklib.searchcommands import dispatch, StreamingCommand, Configuration, Option, validators
 
@@ -20,6 +59,218 @@ BASE_DIR = make_splunkhome_path(["etc","apps","nlp-text-analytics"])
 CORPORA_DIR = os.path.join(BASE_DIR,'bin','nltk_data')
 nltk_data_path.append(CORPORA_DIR)
 
+_LM = WordNetLemmatizer()
+try:
+    #native snowball binding, stems a whole token list per call
+    import snowballstemmer
+    _STEMMER = snowballstemmer.stemmer('english')
+    _stem_word = _STEMMER.stemWord
+    _batch_stem = _STEMMER.stemWords
+except ImportError:
+    _STEMMER = SnowballStemmer('english')
+    _stem_word = _STEMMER.stem
+    _batch_stem = None
+
+@lru_cache(maxsize=200000)
+def _lemma(word):
+    return _LM.lemmatize(word)
+
+@lru_cache(maxsize=200000)
+def _lemma_pos(word, pos):
+    return _LM.lemmatize(word, pos)
+
+#noun lemmatization can only change a word that carries one of morphy's
+#noun suffixes (all end in s, plus men->man) or appears in the noun.exc
+#irregular list (feet, mice, ...); everything else can skip WordNet
+_NOUN_SUFFIXES = ('s', 'men')
+
+_NOUN_EXC = None
+
+def _get_noun_exceptions():
+    global _NOUN_EXC
+    if _NOUN_EXC is None:
+        _NOUN_EXC = frozenset(wordnet._exception_map[NOUN])
+    return _NOUN_EXC
+
+def _fast_lemma(word):
+    if not word.endswith(_NOUN_SUFFIXES) and word not in _get_noun_exceptions():
+        return word
+    return _lemma(word)
+
+#optional GPU stemming via RAPIDS, opt-in with NLP_USE_GPU=1; only worth
+#the host-to-device copy on large token batches
+_GPU_STEM = None
+_GPU_STEM_MIN_TOKENS = 4096
+if os.environ.get('NLP_USE_GPU') == '1':
+    try:
+        import cudf
+        from cuml.preprocessing.text.stem import PorterStemmer as _CuPorterStemmer
+        _GPU_STEM = _CuPorterStemmer()
+    except ImportError:
+        pass
+
+#cuML implements classic Porter, not Snowball; small batches that stay on
+#the CPU must use the same algorithm or the same word would stem
+#differently across records within one search
+_PORTER = PorterStemmer() if _GPU_STEM is not None else None
+
+@lru_cache(maxsize=200000)
+def _porter_stem(word):
+    return _PORTER.stem(word)
+
+_LANCASTER = LancasterStemmer()
+
+@lru_cache(maxsize=200000)
+def _stem(word):
+    return _stem_word(word)
+
+@lru_cache(maxsize=200000)
+def _lanc(word):
+    return _LANCASTER.stem(word)
+
+def _stem_words(tokens):
+    if _GPU_STEM is not None:
+        if len(tokens) >= _GPU_STEM_MIN_TOKENS:
+            return _GPU_STEM.stem(cudf.Series(tokens)).to_arrow().to_pylist()
+        return [_porter_stem(text) for text in tokens]
+    if _batch_stem is not None:
+        return _batch_stem(tokens)
+    return [_stem(text) for text in tokens]
+
+#single C-level pass that deletes punctuation and digits, in place of the
+#per-token [\W\d] regex substitution; underscore stays since it is a \w
+#character the old pattern kept
+_DELETE_CHARS = (punctuation + digits).replace('_', '')
+if six.PY2:
+    _TRANS = maketrans('', '')
+    def _strip_punct_digits(text):
+        return text.translate(_TRANS, _DELETE_CHARS)
+else:
+    _TRANS = str.maketrans('', '', _DELETE_CHARS)
+    def _strip_punct_digits(text):
+        return text.translate(_TRANS)
+
+_URL_RE = re.compile(r'https?://[^\b\s<]+')
+_URL_BATCH_SIZE = 1024
+
+try:
+    #optional JIT-compiled DFA scan for URL stripping; one pass over the
+    #bytes instead of a backtracking re traversal
+    import hyperscan
+    _HS_DB = hyperscan.Database()
+    _HS_DB.compile(
+        expressions=[br'https?://[^\s<\x08]+'],
+        ids=[0],
+        flags=[hyperscan.HS_FLAG_SOM_LEFTMOST]
+    )
+    def _remove_urls(text):
+        #collect the match spans from one scan, then splice the string
+        #back together from the unmatched ranges
+        data = text if isinstance(text, bytes) else text.encode('utf-8')
+        spans = []
+        _HS_DB.scan(
+            data,
+            match_event_handler=
+                lambda eid, start, end, flags, ctx: spans.append((start, end))
+        )
+        if not spans:
+            return text
+        spans.sort()
+        parts = []
+        pos = 0
+        for start, end in spans:
+            if start > pos:
+                parts.append(data[pos:start])
+            pos = max(pos, end)
+        parts.append(data[pos:])
+        out = b''.join(parts)
+        return out if isinstance(text, bytes) else out.decode('utf-8')
+except ImportError:
+    _HS_DB = None
+    def _remove_urls(text):
+        return _URL_RE.sub('', text)
+_SPLIT_RE = re.compile(r'\W+')
+_NONWORD_RE = re.compile(r'[\W]')
+
+#normalize the incoming text field to the native str type exactly once per
+#record; the lemma_pos path used to do its own decode/encode while every
+#other path worked on the raw value
+if six.PY2:
+    def _to_text(text):
+        if isinstance(text, str):
+            return text.decode('utf-8', 'ignore').encode('ascii', 'ignore')
+        return text.encode('ascii', 'ignore')
+else:
+    def _to_text(text):
+        if isinstance(text, bytes):
+            return text.decode('utf-8', 'ignore')
+        return text
+
+_TREE_TOKENIZE = TreebankWordTokenizer().tokenize
+
+_PUNKT = None
+
+def _word_tokenize(text):
+    #same Punkt sentence split + Treebank pass as nltk.word_tokenize, but
+    #with the Punkt model held once per process; skipping the sentence
+    #split would leave sentence-internal periods glued to the final word
+    global _PUNKT
+    if _PUNKT is None:
+        _PUNKT = nltk_data_load('tokenizers/punkt/english.pickle')
+    tokens = []
+    for sentence in _PUNKT.tokenize(text):
+        tokens.extend(_TREE_TOKENIZE(sentence))
+    return tokens
+
+_TAGGER = None
+
+def _get_tagger():
+    #PerceptronTagger loads its pickled model on construction and nltk's
+    #pos_tag rebuilds it on every call; keep one instance per process
+    global _TAGGER
+    if _TAGGER is None:
+        _TAGGER = PerceptronTagger()
+    return _TAGGER
+
+#record batches handed to the worker pool when parallel=true; the pool is
+#forked after the processor is selected so workers inherit it through this
+#module global rather than by pickling the closure
+_PARALLEL_BATCH_SIZE = 2048
+_PARALLEL_CHUNK_SIZE = 64
+_PARALLEL_PROCESSOR = None
+
+def _process_record(record):
+    _PARALLEL_PROCESSOR(record)
+    return record
+
+def _can_fork():
+    #the pool shares the selected processor through fork-inherited
+    #globals; spawn-started workers (Windows) would see it as None
+    if os.name != 'posix':
+        return False
+    get_start_method = getattr(multiprocessing, 'get_start_method', None)
+    if get_start_method is not None:
+        return get_start_method() == 'fork'
+    return True
+
+#treebank tag prefix -> wordnet POS constant, one dict lookup per token
+#instead of a startswith cascade
+_WN_POS = {
+    'J': ADJ,
+    'V': VERB,
+    'N': NOUN,
+    'R': ADV,
+}
+
+_STOPWORDS_EN = None
+
+def _get_stopwords():
+    #load the english stopword corpus once and reuse it across records
+    global _STOPWORDS_EN
+    if _STOPWORDS_EN is None:
+        _STOPWORDS_EN = frozenset(stop_words.words('english'))
+    return _STOPWORDS_EN
+
 
 @Configuration(local=True)
 class CleanText(StreamingCommand):
@@ -88,7 +339,8 @@ class CleanText(StreamingCommand):
     base_type = Option(
         default='lemma',
         doc='''**Syntax:** **base_type=***<string>*
-        **Description:** Options are lemma, lemma_pos, or stem, defaults to lemma and subject to value of base_word setting being true''',
+        **Description:** Options are lemma, lemma_pos, stem, or lancaster; defaults to lemma and subject to value of base_word setting being true.
+        lancaster is faster than stem but more aggressive, so words can be cut down to unintuitive bases''',
         ) 	
     mv = Option(
         default=True,
@@ -127,7 +379,15 @@ class CleanText(StreamingCommand):
         doc='''**Syntax:** **ngram_mix=***<boolean>*
         **Description:** Determines if ngram output is combined or separate columns. Defaults to false which results in separate columns''',
         validate=validators.Boolean()
-        ) 	
+        )
+    parallel = Option(
+        default=False,
+        doc='''**Syntax:** **parallel=***<boolean>*
+        **Description:** Spread text processing over a pool of worker processes, one per core. Defaults
+        to false since Splunk usually runs several searches or pipelines in parallel already. Requires a
+        platform that forks worker processes (Linux/macOS); elsewhere records are processed serially''',
+        validate=validators.Boolean()
+        )
 
     #http://dev.splunk.com/view/logging/SP-CAAAFCN
     def setup_logging(self):
@@ -158,30 +418,212 @@ class CleanText(StreamingCommand):
 
     #https://stackoverflow.com/a/15590384
     def get_wordnet_pos(self, treebank_tag):
-        if treebank_tag.startswith('J'):
-            return wordnet.ADJ
-        elif treebank_tag.startswith('V'):
-            return wordnet.VERB
-        elif treebank_tag.startswith('N'):
-            return wordnet.NOUN
-        elif treebank_tag.startswith('R'):
-            return wordnet.ADV
-        else:
-            return 'n'
+        return _WN_POS.get(treebank_tag[:1], NOUN)
     
     def f_remove_urls(self, text):
-        return re.sub(
-            'https?://[^\b\s<]+',
-            '',
-            text
+        return _remove_urls(text)
+
+    def remove_urls_batched(self, records):
+        #buffer records so URL stripping runs as one vectorized pandas
+        #pass per batch, amortizing the regex call overhead; falls back
+        #to a per-record substitution when pandas is not installed
+        buf = []
+        for record in records:
+            buf.append(record)
+            if len(buf) >= _URL_BATCH_SIZE:
+                for record in self.flush_url_batch(buf):
+                    yield record
+                buf = []
+        for record in self.flush_url_batch(buf):
+            yield record
+
+    def flush_url_batch(self, buf):
+        textfield = self.textfield
+        keep_orig = self.keep_orig
+        if keep_orig:
+            for record in buf:
+                record['orig_text'] = record[textfield]
+        #the hyperscan scanner beats the pandas regex substitution, so
+        #pandas only batches when the DFA path is unavailable
+        if pd is not None and _HS_DB is None:
+            series = pd.Series(
+                [record[textfield] for record in buf]
+            ).str.replace(_URL_RE, '', regex=True)
+            for i, record in enumerate(buf):
+                record[textfield] = series.iat[i]
+                yield record
+        else:
+            for record in buf:
+                record[textfield] = _remove_urls(record[textfield])
+                yield record
+
+    def clean_pos_tokens(self, words, tags, stopwords=None):
+        #clean each token once rather than re-running the regexes in both
+        #the filter and the projection of a list comprehension; words and
+        #tags stay as parallel lists so no per-token pair is allocated
+        out_words = []
+        out_tags = []
+        append_word = out_words.append
+        append_tag = out_tags.append
+        for tok, tag in zip(words, tags):
+            if _NONWORD_RE.search(tok):
+                continue
+            cleaned = _strip_punct_digits(tok).lower()
+            if stopwords is not None and cleaned in stopwords:
+                continue
+            append_word(cleaned)
+            append_tag(tag)
+        return out_words, out_tags
+
+    def make_token_processor(self, stopwords):
+        #resolve the option flags once so the per-record function cleans,
+        #drops stopwords, and base-forms the tokens in one traversal
+        #without re-testing the options
+        do_clean = self.default_clean and self.base_type != 'lemma_pos'
+        base_type = self.base_type if self.base_word else None
+        drop_stopwords = self.remove_stopwords and (
+            not self.base_word or base_type in ('lemma', 'stem', 'lancaster')
         )
+        do_lemma = base_type == 'lemma'
+        do_lanc = base_type == 'lancaster'
+        do_stem = base_type == 'stem'
+        strip = _strip_punct_digits
+        lemma = _fast_lemma
+        lanc = _lanc
+        def process_tokens(tokens):
+            out = []
+            append = out.append
+            for text in tokens:
+                if do_clean:
+                    text = strip(text).lower()
+                if drop_stopwords and text in stopwords:
+                    continue
+                if do_lemma:
+                    text = lemma(text)
+                elif do_lanc:
+                    text = lanc(text)
+                append(text)
+            if do_stem:
+                out = _stem_words(out)
+            return out
+        return process_tokens
+
+    def lemma_pos_record(self, record, words, tags):
+        #Lemmatization with POS tagging; the record keys are written once
+        #after the loop instead of being rebound on every kept token
+        keep_words = []
+        tuple_list = []
+        tag_list = []
+        append_word = keep_words.append
+        append_tup = tuple_list.append
+        append_tag = tag_list.append
+        get_pos = self.get_wordnet_pos
+        wn_noun = NOUN
+        noun_exc = _get_noun_exceptions()
+        for tok, tag in zip(words, tags):
+            pos = get_pos(tag)
+            #nouns with no morphy suffix and no irregular-plural entry
+            #lemmatize to themselves; other parts of speech still need
+            #the full WordNet lookup
+            if pos == wn_noun and not tok.endswith(_NOUN_SUFFIXES) \
+                    and tok not in noun_exc:
+                keep_text = tok.encode('ascii', 'ignore')
+            else:
+                keep_text = _lemma_pos(tok, pos).encode('ascii', 'ignore')
+            if keep_text:
+                append_word(keep_text)
+                append_tup([keep_text, tag])
+                append_tag(tag)
+        record[self.textfield] = keep_words
+        record['pos_tag'] = tag_list
+        if tuple_list:
+            record['pos_tuple'] = tuple_list
+        else:
+            #nothing kept: match the old behavior of leaving the cleaned
+            #word/tag pairs in place
+            record['pos_tuple'] = [[tok, tag] for tok, tag in zip(words, tags)]
+
+    def select_processor(self, stopwords):
+        #pick the record-processing function once per invocation, based on
+        #the immutable option values, instead of rerunning the branch
+        #cascade for every record
+        textfield = self.textfield
+        if self.base_word and self.base_type == 'lemma_pos':
+            tagset = self.pos_tagset
+            do_clean = self.default_clean
+            stopset = stopwords if self.remove_stopwords else None
+            tag = _get_tagger().tag
+            def process(record):
+                tagged = tag(_word_tokenize(record[textfield]))
+                #parallel word/tag lists (SoA) through the pipeline; pairs
+                #are only materialized once for the pos_tuple output field
+                words = [token for token, pos in tagged]
+                tags = [pos for token, pos in tagged]
+                if tagset:
+                    tags = [map_tag('en-ptb', tagset, pos) for pos in tags]
+                if do_clean:
+                    words, tags = self.clean_pos_tokens(words, tags, stopset)
+                self.lemma_pos_record(record, words, tags)
+            return process
+        if self.force_nltk_tokenize:
+            tokenize = word_tokenize
+        elif self.default_clean or (self.base_word and self.base_type == 'lemma'):
+            #https://stackoverflow.com/a/1059601
+            tokenize = _SPLIT_RE.split
+        else:
+            tokenize = str.split
+        process_tokens = self.make_token_processor(stopwords)
+        def process(record):
+            record[textfield] = process_tokens(tokenize(record[textfield]))
+        return process
+
+    def apply_processor(self, records, processor, keep_orig):
+        #ingress normalization plus the selected processor, either inline
+        #or farmed out in batches to a forked worker pool
+        textfield = self.textfield
+        if not self.parallel or not _can_fork():
+            for record in records:
+                if keep_orig:
+                    record['orig_text'] = record[textfield]
+                record[textfield] = _to_text(record[textfield])
+                processor(record)
+                yield record
+            return
+        #the pool is created after the module global is set so forked
+        #workers inherit the processor closure
+        global _PARALLEL_PROCESSOR
+        _PARALLEL_PROCESSOR = processor
+        pool = multiprocessing.Pool()
+        try:
+            batch = []
+            for record in records:
+                if keep_orig:
+                    record['orig_text'] = record[textfield]
+                record[textfield] = _to_text(record[textfield])
+                batch.append(record)
+                if len(batch) >= _PARALLEL_BATCH_SIZE:
+                    for record in pool.map(
+                            _process_record, batch, _PARALLEL_CHUNK_SIZE):
+                        yield record
+                    batch = []
+            for record in pool.map(
+                    _process_record, batch, _PARALLEL_CHUNK_SIZE):
+                yield record
+        finally:
+            pool.close()
+            pool.join()
 
     def ngram(self, text, min_n, max_n):
+        #accepts any iterable of tokens; only materializes it when more
+        #than one n value has to consume the stream
+        if max_n - min_n > 1:
+            text = list(text)
         ngram_list = []
+        append = ngram_list.append
         for n in range(min_n,max_n):
             for ngram in ngrams(text, n):
                 if len(ngram) > 1:
-                    ngram_list.append((len(ngram),' '.join(ngram)))
+                    append((len(ngram),' '.join(ngram)))
         return ngram_list
 
 
@@ -190,146 +632,31 @@ class CleanText(StreamingCommand):
         logger.info('textfield set to: ' + self.textfield)
         if self.custom_stopwords:
             custom_stopwords = self.custom_stopwords.replace(' ','').split(',')
-        for record in records:
-            if self.keep_orig:
-                record['orig_text'] = record[self.textfield]
-            #URL removal
-            if self.remove_urls:
-                record[self.textfield] = self.f_remove_urls(
-                    record[self.textfield]
-                )
-            #Tokenization
-            if (self.base_word and self.base_type == 'lemma_pos') or self.force_nltk_tokenize:
-                #lemma_pos - if option is lemmatization with POS tagging do cleaning and stopword options now
-                if (self.base_word and self.base_type == 'lemma_pos'):
-                    record['pos_tuple'] = pos_tag(
-                        word_tokenize(
-                            record[self.textfield].decode('utf-8').encode('ascii', 'ignore')
-                        ),
-                        tagset=self.pos_tagset
-                    )
-                    if self.default_clean and self.remove_stopwords:
-                        if self.custom_stopwords:
-                            stopwords = set(stop_words.words('english') + custom_stopwords)
-                        else:
-                            stopwords = set(stop_words.words('english'))
-                        record['pos_tuple'] = [
-                            [
-                            re.sub(r'[\W\d]','',text[0]).lower(),
-                            text[1]
-                            ]
-                            for text in
-                            record['pos_tuple']
-                            if re.sub(r'[\W\d]','',text[0]).lower() not in stopwords
-                            and not re.search(r'[\W]',text[0])
-                        ]
-                    elif self.default_clean and not self.remove_stopwords:
-                        record['pos_tuple'] = [
-                            [
-                            re.sub(r'[\W\d]','',text[0]).lower(),
-                            text[1]
-                            ]
-                            for text in
-                            record['pos_tuple']
-                            if not re.search(r'[\W]',text[0])
-                        ]
-                elif self.force_nltk_tokenize:
-                    record[self.textfield] = word_tokenize(
-                        record[self.textfield]
-                    )
-            elif self.default_clean or (self.base_word and self.base_type == 'lemma'):
-                #https://stackoverflow.com/a/1059601
-                record[self.textfield] = re.split('\W+', record[self.textfield])
-            else:
-                record[self.textfield] = record[self.textfield].split()
-            #Default Clean
-            if self.default_clean and not self.base_type == 'lemma_pos':
-                record[self.textfield] = [
-                    re.sub(r'[\W\d]','',text).lower()
-                    for text in
-                    record[self.textfield]
-                ]
-            #Lemmatization with POS tagging
-            if self.base_word and self.base_type == 'lemma_pos':
-                    lm = WordNetLemmatizer()
-                    tuple_list = []
-                    tag_list = []
-                    record[self.textfield] = []
-                    record['pos_tag'] = []
-                    for text in record['pos_tuple']:
-                        keep_text = lm.lemmatize(
-                                text[0],
-                                self.get_wordnet_pos(text[1])
-                            ).encode('ascii', 'ignore')
-                        if keep_text:
-                            record[self.textfield].append(keep_text)
-                            tuple_list.append([keep_text,text[1]])
-                            tag_list.append(text[1])
-                            record['pos_tag'] = tag_list
-                            record['pos_tuple'] = tuple_list
-            #Lemmatization or Stemming with stopword removal
-            if self.remove_stopwords and self.base_word and self.base_type != 'lemma_pos':
-                if self.custom_stopwords:
-                    stopwords = set(stop_words.words('english') + custom_stopwords)
-                else:
-                    stopwords = set(stop_words.words('english'))
-                if self.base_type == 'lemma':
-                    lm = WordNetLemmatizer()
-                    record[self.textfield] = [
-                        lm.lemmatize(text)
-                        for text in
-                        record[self.textfield]
-                        if text not in stopwords
-                    ]
-                if self.base_type == 'stem':
-                    ps = PorterStemmer()
-                    record[self.textfield] = [
-                        ps.stem(text)
-                        for text in
-                        record[self.textfield]
-                        if text not in stopwords
-                    ]
-            #Lemmatization or Stemming without stopword removal
-            if not self.remove_stopwords and self.base_word:
-                if self.base_type == 'lemma':
-                    lm = WordNetLemmatizer()
-                    record[self.textfield] = [
-                        lm.lemmatize(text)
-                        for text in
-                        record[self.textfield]
-                    ]
-                if self.base_type == 'stem':
-                    ps = PorterStemmer()
-                    record[self.textfield] = [
-                        ps.stem(text)
-                        for text in
-                        record[self.textfield]
-                    ]
-            #Stopword Removal
-            if self.remove_stopwords and not self.base_word:
-                if self.custom_stopwords:
-                    stopwords = set(stop_words.words('english') + custom_stopwords)
-                else:
-                    stopwords = set(stop_words.words('english'))
-                record[self.textfield] = [
-                    text 
-                    for text in
-                    record[self.textfield]
-                    if text not in stopwords
-                    ]
+            stopwords = _get_stopwords() | frozenset(custom_stopwords)
+        else:
+            stopwords = _get_stopwords()
+        processor = self.select_processor(stopwords)
+        #URL removal in vectorized batches, which also saves orig_text
+        if self.remove_urls:
+            records = self.remove_urls_batched(records)
+        keep_orig = self.keep_orig and not self.remove_urls
+        #Ingress decode then tokenization, cleaning, stopword removal, and
+        #base words, optionally across a pool of worker processes
+        for record in self.apply_processor(records, processor, keep_orig):
             #Minimum term length
             if self.term_min_len > 0:
+                min_len = self.term_min_len
                 record[self.textfield] = [
                      i
                      for i in record[self.textfield]
-                     if len(i) >= self.term_min_len
+                     if len(i) >= min_len
                      ]
             #ngram column creation
             (min_n,max_n) = self.ngram_range.split('-')
             if max_n > 1 and max_n >= min_n:
                 max_n = int(max_n) + 1
                 ngram_extract = self.ngram(
-                    filter(None, record[self.textfield]),
+                    (i for i in record[self.textfield] if i),
                     int(min_n),
                     max_n
                 )
@@ -354,10 +681,8 @@ class CleanText(StreamingCommand):
             #Final Multi-Value Output
             if not self.mv:
                 record[self.textfield] = ' '.join(record[self.textfield])
-                try:
+                if 'pos_tag' in record and isinstance(record['pos_tag'], list):
                     record['pos_tag'] = ' '.join(record['pos_tag'])
-                except:
-                    pass
 
             yield record
 